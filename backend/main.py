@@ -1,10 +1,14 @@
 import os
 import io
+import mmap
 import uuid
+import asyncio
+import threading
 import sys
 import subprocess
 from typing import List, Optional, Dict
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
@@ -17,12 +21,17 @@ try:
 except ImportError:
     aiofiles = None
     HAS_AIOFILES = False
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    HAS_ORJSON = False
 from PIL import Image
 import json
 import cv2
 import numpy as np
 from sklearn.cluster import KMeans
-from scipy.optimize import linear_sum_assignment
 import kociemba
 
 # 큐브 해법 모듈
@@ -34,12 +43,35 @@ from cube_solver import (
 )
 
 try:
-    from rembg import remove
+    from rembg import remove, new_session
     HAS_REMBG = True
 except ImportError:
     HAS_REMBG = False
     print("경고: rembg 라이브러리가 설치되지 않았습니다. 배경 제거 없이 진행됩니다.")
 
+# rembg 세션 (첫 사용 시 한 번만 모델 로드, 이후 요청에서 재사용)
+_REMBG_SESSION = None
+_REMBG_SESSION_LOCK = threading.Lock()  # 여러 면을 동시에 처리할 때 세션이 두 번 만들어지지 않도록
+
+# 배경 제거 모델 ('u2netp'로 바꾸면 경량 모델로 훨씬 빠르지만 마스크 품질 확인 필요)
+REMBG_MODEL = os.environ.get("REMBG_MODEL", "u2net")
+
+# ONNX Runtime provider 우선순위 (GPU/NPU → CPU)
+PREFERRED_PROVIDERS = ['CUDAExecutionProvider', 'CoreMLExecutionProvider', 'CPUExecutionProvider']
+
+def get_rembg_session():
+    """배경 제거용 rembg 세션 반환 (지연 생성 후 캐시, 사용 가능한 GPU provider 우선)"""
+    global _REMBG_SESSION
+    if _REMBG_SESSION is None:
+        with _REMBG_SESSION_LOCK:
+            if _REMBG_SESSION is None:
+                import onnxruntime as ort
+                available = ort.get_available_providers()
+                providers = [p for p in PREFERRED_PROVIDERS if p in available] or ['CPUExecutionProvider']
+                _REMBG_SESSION = new_session(REMBG_MODEL, providers=providers)
+                print(f"rembg 세션 생성 ({REMBG_MODEL}, providers: {', '.join(providers)})")
+    return _REMBG_SESSION
+
 app = FastAPI(title="Rubik's Cube Image API", version="1.0.0")
 
 # CORS 설정 (프론트엔드와 통신을 위해)
@@ -60,6 +92,7 @@ app.mount("/images", StaticFiles(directory=UPLOAD_DIR), name="images")
 
 # 세션 관리
 SESSIONS = {}  # {session_id: {"created_at": datetime, "images": {...}}}
+SESSION_DIRS: Dict[str, Path] = {}  # {session_id: 생성 확인된 세션 디렉토리}
 
 @app.on_event("startup")
 async def startup_event():
@@ -151,9 +184,12 @@ def get_session_id(request=None) -> str:
     return session_id
 
 def get_session_upload_dir(session_id: str) -> Path:
-    """세션별 업로드 디렉토리 반환"""
-    session_dir = UPLOAD_DIR / session_id
-    session_dir.mkdir(parents=True, exist_ok=True)
+    """세션별 업로드 디렉토리 반환 (한 번 생성한 디렉토리는 캐시)"""
+    session_dir = SESSION_DIRS.get(session_id)
+    if session_dir is None:
+        session_dir = UPLOAD_DIR / session_id
+        session_dir.mkdir(parents=True, exist_ok=True)
+        SESSION_DIRS[session_id] = session_dir
     return session_dir
 
 def validate_session(session_id: str, auto_restore: bool = True) -> bool:
@@ -169,6 +205,20 @@ def validate_session(session_id: str, auto_restore: bool = True) -> bool:
     
     return False
 
+# 이 크기를 넘는 JSON 파일은 mmap으로 읽음 (64KB)
+# 일반적인 analyzed_colors.json(6면 x 9칸 + 클러스터 중심)은 수 KB라 보통은 기존 읽기 경로를 사용
+# orjson은 선택 의존성 (설치되어 있으면 사용, 없으면 json으로 파싱)
+MMAP_READ_THRESHOLD = 64 * 1024
+
+def read_json_mmap(path: Path):
+    """큰 JSON 파일을 mmap으로 읽기 (orjson 사용 가능 시 버퍼 복사 없이 파싱)"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if HAS_ORJSON:
+                with memoryview(mm) as buf:
+                    return orjson.loads(buf)  # type: ignore
+            return json.loads(mm[:])
+
 # 큐브 면 정보
 CUBE_FACES = ["U", "D", "F", "B", "L", "R"]
 
@@ -267,6 +317,7 @@ async def delete_session(request: Request):
     
     # 세션 정보 삭제
     del SESSIONS[session_id]
+    SESSION_DIRS.pop(session_id, None)
     
     return {
         "success": True,
@@ -512,6 +563,14 @@ async def health_check():
 
 # ==================== RGB + HSV 이중 클러스터링 기반 색상 분석 (remove_bg.py에서 가져옴) ====================
 
+# 색상/판정 이유 정수 코드 (칸별 투표는 코드 배열로 계산, 응답에는 이름으로 변환)
+COLOR_NAMES = ('white', 'yellow', 'orange', 'red', 'green', 'blue')
+WHITE, YELLOW, ORANGE, RED, GREEN, BLUE = range(6)
+COLOR_CODES = {name: code for code, name in enumerate(COLOR_NAMES)}
+
+REASON_NAMES = ('both_agree', 'hsv_recheck', 'rgb_wins', 'hsv_wins')
+BOTH_AGREE, HSV_RECHECK, RGB_WINS, HSV_WINS = range(4)
+
 # 기준 RGB 값 정의
 REFERENCE_COLORS_RGB = {
     'white':  np.array([220, 230, 240]),
@@ -532,47 +591,71 @@ REFERENCE_COLORS_HSV = {
     'blue':   np.array([106, 215, 145])
 }
 
-def rgb_distance(rgb1, rgb2):
-    """RGB 유클리드 거리"""
-    return np.sqrt(np.sum((rgb1 - rgb2) ** 2))
+# 거리 계산용 기준 색상 배열 (float32로 한 번만 변환, 행 순서는 REFERENCE_NAMES)
+REFERENCE_NAMES = tuple(REFERENCE_COLORS_RGB)
+REFERENCE_RGB_ARRAY = np.array([REFERENCE_COLORS_RGB[name] for name in REFERENCE_NAMES], dtype=np.float32)
+REFERENCE_HSV_ARRAY = np.array([REFERENCE_COLORS_HSV[name] for name in REFERENCE_NAMES], dtype=np.float32)
+
+# K-means 설정 (두 색공간 공통)
+# 칸이 수십 개뿐이라 10회 재시작도 수 ms 수준이고, n_init=1/3이나 MiniBatchKMeans는
+# 실제 큐브 사진에서 더 나쁜 국소해(관성 2~10% 증가, 라벨 분할 변경)로 자주 수렴해 그대로 유지
+# (faiss.Kmeans는 초기화가 달라 라벨이 바뀌고 의존성만 늘며, float32 입력은 이 크기에서 오히려 약 10% 느림)
+KMEANS_PARAMS = dict(n_clusters=6, random_state=42, n_init=10)
+
+# OpenCV 8비트 RGB→HSV 변환과 동일한 고정소수점 나눗셈 테이블
+_DIV_IDX = np.arange(256)
+_SDIV_TABLE = np.zeros(256, dtype=np.int64)
+_SDIV_TABLE[1:] = np.rint((255 << 12) / _DIV_IDX[1:])
+_HDIV_TABLE = np.zeros(256, dtype=np.int64)
+_HDIV_TABLE[1:] = np.rint((180 << 12) / (6.0 * _DIV_IDX[1:]))
 
-def hsv_distance(hsv1, hsv2):
-    """HSV 거리 (Hue는 원형)"""
-    h1, s1, v1 = hsv1
-    h2, s2, v2 = hsv2
+def rgb_to_hsv_array(rgb_array):
+    """
+    (N, 3) RGB 배열을 한 번에 HSV로 변환
+    cv2.COLOR_RGB2HSV(8비트, H=0-180)와 동일한 결과
+    """
+    rgb = np.asarray(rgb_array).astype(np.uint8).astype(np.int64)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    v = rgb.max(axis=-1)
+    diff = v - rgb.min(axis=-1)
     
-    dh = min(abs(h1 - h2), 180 - abs(h1 - h2))
-    ds = abs(s1 - s2)
-    dv = abs(v1 - v2)
+    s = (diff * _SDIV_TABLE[v] + (1 << 11)) >> 12
+    h = np.where(v == r, g - b, np.where(v == g, b - r + 2 * diff, r - g + 4 * diff))
+    h = (h * _HDIV_TABLE[diff] + (1 << 11)) >> 12
+    h = np.where(h < 0, h + 180, h)
     
-    return np.sqrt((dh * 2.0) ** 2 + (ds * 1.0) ** 2 + (dv * 0.8) ** 2)
+    return np.stack([h, s, v], axis=-1).astype(np.uint8)
 
-def match_clusters_to_colors(cluster_centers, reference_colors, distance_func):
+def rgb_distance_sq(rgb1, rgb2):
+    """RGB 유클리드 거리의 제곱 (마지막 축 기준이라 배열끼리 브로드캐스트 가능)"""
+    diff = rgb1 - rgb2
+    return np.sum(diff * diff, axis=-1)
+
+# HSV 거리 가중치 (H, S, V)의 제곱을 미리 계산
+HSV_WEIGHTS_SQ = np.array([2.0, 1.0, 0.8], dtype=np.float32) ** 2
+
+def hsv_distance_sq(hsv1, hsv2):
+    """HSV 거리의 제곱 (Hue는 원형, 마지막 축 기준이라 배열끼리 브로드캐스트 가능)"""
+    diff = np.abs(hsv1 - hsv2)
+    diff[..., 0] = np.minimum(diff[..., 0], 180 - diff[..., 0])
+    
+    # 가중 제곱합을 행렬곱 한 번으로 계산
+    return (diff * diff) @ HSV_WEIGHTS_SQ
+
+def match_clusters_to_colors(cluster_centers, reference_array, distance_sq_func):
     """
     클러스터 중심을 기준 색상에 매칭 (단순 최근접)
-    각 클러스터를 가장 가까운 기준 색상에 바로 매칭
+    (클러스터 수 x 기준 색상 수) 제곱 거리 행렬에서 행마다 최솟값을 고르고,
+    sqrt는 선택된 거리에만 적용 (순서는 제곱 거리와 같음)
     """
-    n_clusters = len(cluster_centers)
-    color_names = list(reference_colors.keys())
+    centers = np.asarray(cluster_centers, dtype=np.float32)
     
-    cluster_to_color = {}
-    cluster_distances = {}
+    distances_sq = distance_sq_func(centers[:, None, :], reference_array[None, :, :])
+    best = distances_sq.argmin(axis=1)
+    min_distances = np.sqrt(distances_sq[np.arange(len(centers)), best])
     
-    # 각 클러스터를 가장 가까운 기준 색상에 매칭
-    for cluster_id, cluster_center in enumerate(cluster_centers):
-        min_distance = float('inf')
-        best_color = None
-        
-        for color_name in color_names:
-            ref_color = reference_colors[color_name]
-            dist = distance_func(cluster_center, ref_color)
-            
-            if dist < min_distance:
-                min_distance = dist
-                best_color = color_name
-        
-        cluster_to_color[cluster_id] = best_color
-        cluster_distances[cluster_id] = min_distance
+    cluster_to_color = {cluster_id: REFERENCE_NAMES[idx] for cluster_id, idx in enumerate(best)}
+    cluster_distances = dict(enumerate(min_distances))
     
     return cluster_to_color, cluster_distances
 
@@ -630,107 +713,121 @@ def apply_hue_based_rules(cluster_to_color, cluster_centers_hsv):
     
     return cluster_to_color
 
-def ensemble_vote(rgb_color, hsv_color, rgb_dist, hsv_dist, hsv_raw=None):
+def ensemble_vote(rgb_colors, hsv_colors, rgb_dists, hsv_dists, hsv_raw):
     """
-    2중 투표: RGB와 HSV 결과를 종합
+    2중 투표: RGB와 HSV 결과를 종합 (모든 칸을 한 번에 마스크 연산으로 처리)
     RGB를 훨씬 더 신뢰 (조명 변화에 강건)
     
     Args:
-        hsv_raw: 개별 칸의 실제 HSV 값 [H, S, V] (재검증용)
+        rgb_colors, hsv_colors: 칸별 색상 코드 (N,)
+        rgb_dists, hsv_dists: 칸이 속한 클러스터의 기준 색상 거리 (N,)
+        hsv_raw: 개별 칸의 실제 HSV 값 (N, 3) (재검증용)
     
     Returns:
-        (final_color, confidence, reason)
+        (최종 색상 코드, confidence, 판정 이유 코드) 각각 (N,) 배열
     """
-    # 0. 개별 HSV 재검증 (클러스터링 오류 보정)
-    if hsv_raw is not None:
-        h, s, v = hsv_raw
-        
-        # yellow 보정: H=38-60이고 채도 충분하면 무조건 yellow
-        if 38 <= h <= 60 and s > 120 and v > 150:
-            # RGB도 yellow면 확신
-            if rgb_color == 'yellow':
-                return 'yellow', 1.0, 'both_agree'
-            # RGB가 green이어도 HSV 재검증으로 yellow 확정
-            else:
-                return 'yellow', 0.95, 'hsv_recheck'
-        
-        # orange 보정: H=5-10°이고 밝으면 (V>160) 무조건 orange
-        if 5 <= h <= 10 and v > 160:
-            # RGB도 orange면 확신
-            if rgb_color == 'orange':
-                return 'orange', 1.0, 'both_agree'
-            # RGB가 red여도 HSV 재검증으로 orange 확정
-            else:
-                return 'orange', 0.95, 'hsv_recheck'
-        
-        # red 확정: H<5이고 어두우면 (V<160) 무조건 red
-        if h < 5 and v < 160 and s > 140:
-            if rgb_color == 'red':
-                return 'red', 1.0, 'both_agree'
-            else:
-                return 'red', 0.95, 'hsv_recheck'
+    h, s, v = (np.asarray(hsv_raw, dtype=np.int32)[:, i] for i in range(3))
+    
+    # 0. 개별 HSV 재검증 (클러스터링 오류 보정), 앞 규칙이 우선
+    # yellow: H=38-60이고 채도 충분 / orange: H=5-10°이고 밝음 (V>160) / red: H<5이고 어두움 (V<160)
+    recheck_color = np.select(
+        [(38 <= h) & (h <= 60) & (s > 120) & (v > 150),
+         (5 <= h) & (h <= 10) & (v > 160),
+         (h < 5) & (v < 160) & (s > 140)],
+        [YELLOW, ORANGE, RED],
+        default=-1
+    )
+    recheck = recheck_color >= 0
+    # RGB도 같은 색이면 확신, 아니면 HSV 재검증으로 확정
+    recheck_agree = recheck_color == rgb_colors
     
     # 1. 두 결과 일치 → 확신도 매우 높음
-    if rgb_color == hsv_color:
-        return rgb_color, 1.0, 'both_agree'
+    agree = rgb_colors == hsv_colors
     
     # 2. 불일치 → RGB를 훨씬 더 신뢰
-    rgb_confidence = 1.0 / (1.0 + rgb_dist / 50.0)
-    hsv_confidence = 1.0 / (1.0 + hsv_dist / 100.0)
+    rgb_confidence = 1.0 / (1.0 + rgb_dists / 50.0)
+    hsv_confidence = 1.0 / (1.0 + hsv_dists / 100.0)
     
     # 3. RGB 가중치 3배 (조명 변화에 훨씬 안정적)
-    rgb_weighted = rgb_confidence * 3.0
-    hsv_weighted = hsv_confidence * 1.0
+    rgb_wins = rgb_confidence * 3.0 > hsv_confidence * 1.0
     
-    if rgb_weighted > hsv_weighted:
-        final_confidence = rgb_confidence * 0.90
-        return rgb_color, final_confidence, 'rgb_wins'
-    else:
-        final_confidence = hsv_confidence * 0.85
-        return hsv_color, final_confidence, 'hsv_wins'
-
-def extract_rgb_from_cell(img_array, row, col, sample_ratio=0.4):
-    """단일 셀에서 RGB 추출"""
-    height, width = img_array.shape[:2]
-    cell_height = height // 3
-    cell_width = width // 3
+    conditions = [recheck, agree, rgb_wins]
+    final_colors = np.select(conditions, [recheck_color, rgb_colors, rgb_colors], default=hsv_colors)
+    confidences = np.select(conditions, [np.where(recheck_agree, 1.0, 0.95), 1.0, rgb_confidence * 0.90],
+                            default=hsv_confidence * 0.85)
+    reasons = np.select(conditions, [np.where(recheck_agree, BOTH_AGREE, HSV_RECHECK), BOTH_AGREE, RGB_WINS],
+                        default=HSV_WINS)
     
-    cell_y = row * cell_height
-    cell_x = col * cell_width
+    return final_colors, confidences, reasons
+
+# 3x3 격자 / 정사각형 크기 (파이프라인 고정값)
+GRID_SIZE = 3
+SQUARE_SIZE = 800
+SAMPLE_RATIO = 0.4
+
+@lru_cache(maxsize=None)
+def cell_layout(height, width, sample_ratio=SAMPLE_RATIO):
+    """
+    면 이미지의 3x3 셀/샘플 창 배치 (크기별로 한 번만 계산하고 재사용)
     
+    Returns:
+        (cell_height, cell_width, sample_height, sample_width, sample_origins)
+        sample_origins: 셀별 샘플 창 좌상단 (x, y) 9개 (행 우선 순서)
+    """
+    cell_height = height // GRID_SIZE
+    cell_width = width // GRID_SIZE
     sample_height = int(cell_height * sample_ratio)
     sample_width = int(cell_width * sample_ratio)
-    start_y = cell_y + (cell_height - sample_height) // 2
-    start_x = cell_x + (cell_width - sample_width) // 2
+    offset_y = (cell_height - sample_height) // 2
+    offset_x = (cell_width - sample_width) // 2
+    sample_origins = tuple((col * cell_width + offset_x, row * cell_height + offset_y)
+                           for row in range(GRID_SIZE) for col in range(GRID_SIZE))
+    return cell_height, cell_width, sample_height, sample_width, sample_origins
+
+# 기본 크기(800x800) 배치는 모듈 로드 시 미리 계산
+cell_layout(SQUARE_SIZE, SQUARE_SIZE)
+
+def extract_all_cells_rgb(img_array, sample_ratio=SAMPLE_RATIO):
+    """
+    9개 셀 중심에서 RGB를 한 번에 추출 ((9, 3) 배열, 행 우선 순서)
+    셀마다 같은 크기의 샘플 창을 (3, sh, 3, sw, C) 스트라이드 뷰로 묶어 평균 한 번으로 계산
+    """
+    cell_height, cell_width, sample_height, sample_width, sample_origins = \
+        cell_layout(*img_array.shape[:2], sample_ratio)
+    start_x, start_y = sample_origins[0]
     
-    sample_region = img_array[start_y:start_y+sample_height, start_x:start_x+sample_width]
-    avg_color = np.mean(sample_region, axis=(0, 1))[:3]
+    base = img_array[start_y:, start_x:]
+    s0, s1, s2 = base.strides
+    windows = np.lib.stride_tricks.as_strided(
+        base,
+        shape=(GRID_SIZE, sample_height, GRID_SIZE, sample_width, base.shape[2]),
+        strides=(cell_height * s0, s0, cell_width * s1, s1, s2),
+        writeable=False
+    )
+    avg_colors = windows.mean(axis=(1, 3))[..., :3]
     
-    return avg_color, (start_x, start_y, sample_width, sample_height)
+    return avg_colors.reshape(GRID_SIZE * GRID_SIZE, 3)
 
 def order_points(pts):
-    """Perspective 변환을 위한 4점 정렬"""
-    rect = np.zeros((4, 2), dtype="float32")
-    s = pts.sum(axis=1)
-    rect[0] = pts[np.argmin(s)]
-    rect[2] = pts[np.argmax(s)]
-    diff = np.diff(pts, axis=1)
-    rect[1] = pts[np.argmin(diff)]
-    rect[3] = pts[np.argmax(diff)]
-    return rect
+    """Perspective 변환을 위한 4점 정렬 (점 4개뿐이라 NumPy 대신 파이썬 연산)"""
+    pts = np.asarray(pts, dtype="float32").tolist()
+    s = [x + y for x, y in pts]
+    diff = [y - x for x, y in pts]
+    tl = pts[s.index(min(s))]
+    br = pts[s.index(max(s))]
+    tr = pts[diff.index(min(diff))]
+    bl = pts[diff.index(max(diff))]
+    return np.array([tl, tr, br, bl], dtype="float32")
 
 def perspective_transform(image, pts):
     """Perspective 변환으로 면 정사각형 만들기"""
     rect = order_points(pts)
-    (tl, tr, br, bl) = rect
-    
-    widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-    widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-    maxWidth = max(int(widthA), int(widthB))
     
-    heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-    heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-    maxHeight = max(int(heightA), int(heightB))
+    # 네 변 길이를 한 번에 계산: br-bl, tr-tl (너비), tr-br, tl-bl (높이)
+    d = rect[[2, 1, 1, 0]] - rect[[3, 0, 2, 3]]
+    lengths = np.hypot(d[:, 0], d[:, 1])
+    maxWidth = max(int(lengths[0]), int(lengths[1]))
+    maxHeight = max(int(lengths[2]), int(lengths[3]))
     
     size = max(maxWidth, maxHeight)
     
@@ -740,10 +837,16 @@ def perspective_transform(image, pts):
         [size - 1, size - 1],
         [0, size - 1]], dtype="float32")
     
-    M = cv2.getPerspectiveTransform(rect, dst)
-    warped = cv2.warpPerspective(image, M, (size, size))
+    # 출력→입력 방향 행렬을 직접 구해 warpPerspective 내부의 역행렬 계산 생략
+    M_inv = cv2.getPerspectiveTransform(dst, rect)
+    warped = cv2.warpPerspective(image, M_inv, (size, size),
+                                 flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                 borderMode=cv2.BORDER_CONSTANT)
     return warped
 
+# 이보다 작은 윤곽은 원근 변환 대신 바운딩 박스 사용
+MIN_WARP_AREA = 1000
+
 def detect_cube_contour(image_array):
     """이미지에서 큐브 윤곽 검출"""
     # 그레이스케일 변환
@@ -764,19 +867,11 @@ def detect_cube_contour(image_array):
     # 가장 큰 윤곽 선택
     largest_contour = max(contours, key=cv2.contourArea)
     
-    # 윤곽 근사화
-    epsilon = 0.02 * cv2.arcLength(largest_contour, True)
-    approx = cv2.approxPolyDP(largest_contour, epsilon, True)
-    
-    if len(approx) >= 4:
-        hull = cv2.convexHull(largest_contour)
-        epsilon2 = 0.02 * cv2.arcLength(hull, True)
-        approx = cv2.approxPolyDP(hull, epsilon2, True)
-        
-        if len(approx) >= 4:
-            rect = cv2.minAreaRect(largest_contour)
-            box = cv2.boxPoints(rect)
-            return box.astype("float32")
+    # 최소 외접 사각형 (퇴화된 작은 윤곽은 바운딩 박스 사용)
+    if cv2.contourArea(largest_contour) >= MIN_WARP_AREA:
+        rect = cv2.minAreaRect(largest_contour)
+        box = cv2.boxPoints(rect)
+        return box.astype("float32")
     
     # 실패시 바운딩 박스 반환
     x, y, w, h = cv2.boundingRect(largest_contour)
@@ -787,7 +882,13 @@ def detect_cube_contour(image_array):
         [x, y + h]
     ], dtype="float32")
 
-def preprocess_cube_image(image_path: Path, target_size=800, use_rembg=True):
+def composite_on_white(rgba):
+    """RGBA 배열을 흰 배경 위에 합성해 RGB uint8 배열로 반환 (uint16 고정소수점 연산)"""
+    alpha = rgba[..., 3:4].astype(np.uint16)
+    blended = rgba[..., :3] * alpha + 255 * (255 - alpha) + 127
+    return (blended // 255).astype(np.uint8)
+
+def preprocess_cube_image(image_path: Path, target_size=SQUARE_SIZE, use_rembg=True):
     """
     큐브 이미지 전처리 및 정사각형 변환
     
@@ -805,7 +906,7 @@ def preprocess_cube_image(image_path: Path, target_size=800, use_rembg=True):
     # 배경 제거 (rembg 사용 가능 시)
     if use_rembg and HAS_REMBG:
         try:
-            img = remove(img)
+            img = remove(img, session=get_rembg_session())
             if img.mode != 'RGBA':
                 img = img.convert('RGBA')
             print(f"  배경 제거 완료: {image_path.name}")
@@ -814,40 +915,43 @@ def preprocess_cube_image(image_path: Path, target_size=800, use_rembg=True):
             if img.mode != 'RGBA':
                 img = img.convert('RGBA')
     
-    # RGB 변환 및 윤곽 검출
+    # 윤곽 검출 (np.asarray: PIL 버퍼를 추가 복사 없이 읽기 전용으로 사용)
     if img.mode == 'RGBA':
-        # 알파 채널을 이용한 윤곽 검출
-        img_array = np.array(img)
-        alpha = img_array[:, :, 3]
-        
-        # 윤곽 검출
-        contour_pts = detect_cube_contour(alpha)
-        
-        if contour_pts is not None:
-            # Perspective 변환
-            warped = perspective_transform(img_array, contour_pts)
-            warped_pil = Image.fromarray(warped)
-        else:
-            warped_pil = img
+        # 알파 채널을 이용한 윤곽 검출 (알파는 흰 배경 합성에도 필요하므로 4채널 그대로 변환)
+        img_array = np.asarray(img)
+        contour_pts = detect_cube_contour(img_array[:, :, 3])
     else:
-        # RGB 이미지인 경우 그대로 사용
-        img_array = np.array(img.convert('RGB'))
+        # RGB 이미지인 경우 3채널만 변환
+        img_array = np.asarray(img.convert('RGB'))
         contour_pts = detect_cube_contour(img_array)
-        
-        if contour_pts is not None:
-            warped = perspective_transform(img_array, contour_pts)
-            warped_pil = Image.fromarray(warped)
-        else:
-            warped_pil = img.convert('RGB')
     
-    # 크기 조정
-    warped_pil = warped_pil.resize((target_size, target_size), Image.Resampling.LANCZOS)
+    # Perspective 변환
+    warped = perspective_transform(img_array, contour_pts) if contour_pts is not None else img_array
     
-    # RGB 배경에 붙이기
-    square_img = Image.new('RGB', (target_size, target_size), (255, 255, 255))
-    square_img.paste(warped_pil, (0, 0), warped_pil if warped_pil.mode == 'RGBA' else None)
+    # 크기 조정 (축소는 INTER_AREA, 확대는 INTER_CUBIC) - PIL 변환 없이 OpenCV로 처리
+    interpolation = cv2.INTER_AREA if warped.shape[0] > target_size else cv2.INTER_CUBIC
+    resized = cv2.resize(warped, (target_size, target_size), interpolation=interpolation)
     
-    return np.array(square_img)
+    # 흰 배경에 합성
+    if resized.shape[2] == 4:
+        return composite_on_white(resized)
+    return resized
+
+def preprocess_face(image_path: Path):
+    """
+    한 면 이미지 전처리 후 9개 칸 RGB 추출 (스레드 풀에서 면마다 실행)
+    
+    Returns:
+        (정사각형 배열, (9, 3) RGB 배열, 오류) - 실패 시 배열은 None, 오류는 예외 객체
+    """
+    try:
+        # 이미지 전처리 (배경 제거 + Perspective 변환)
+        square_array = preprocess_cube_image(image_path)
+        
+        # 9개 칸에서 RGB 한 번에 추출
+        return square_array, extract_all_cells_rgb(square_array), None
+    except Exception as e:
+        return None, None, e
 
 # 색상 레이블 매핑 (K-means 결과를 단일 문자로 변환)
 COLOR_LABEL_MAP = {
@@ -869,12 +973,16 @@ COLOR_MAP = {
     "b": "#0051BA",  # blue
 }
 
+# 분석 응답에 기본으로 포함되는 면별 필드 (나머지는 디버그용)
+ANALYSIS_CORE_FIELDS = ("colors", "hex_colors", "status")
+
 @app.post("/analyze-cube-images")
 async def analyze_cube_images(request: Request):
     """
     특정 세션의 업로드된 모든 큐브 이미지를 RGB + HSV 이중 클러스터링으로 분석하여 색상 데이터 추출
     전체 큐브(54개 칸)를 한번에 분석하여 일관성 있는 색상 인식
     세션 ID는 X-Session-Id 헤더로 전달
+    ?debug=1 쿼리로 칸별 신뢰도/판정 근거와 클러스터 중심을 응답에 포함
     """
     try:
         # 헤더에서 세션 ID 가져오기
@@ -906,29 +1014,26 @@ async def analyze_cube_images(request: Request):
         
         print(f"\n[세션 {session_id[:8]}...] Phase 1: {len(images_info)}개 이미지 전처리 및 RGB 수집")
         
-        for face, metadata in sorted(images_info.items()):
-            image_path = session_dir / metadata["saved_filename"]
-            
-            try:
-                # 이미지 전처리 (배경 제거 + Perspective 변환)
-                square_array = preprocess_cube_image(image_path)
-                
-                # 각 칸에서 RGB 추출
-                for row in range(3):
-                    for col in range(3):
-                        rgb, _ = extract_rgb_from_cell(square_array, row, col)
-                        all_rgb_values.append(rgb)
-                
-                all_images_data.append({
-                    'face': face,
-                    'array': square_array
-                })
-                
-                print(f"  {face} 면: RGB 수집 완료 (9개 칸)")
-                
-            except Exception as e:
-                print(f"  {face} 면 처리 실패: {e}")
+        # 면별 전처리는 서로 독립이므로 스레드에서 동시에 실행
+        # (rembg/OpenCV는 GIL을 풀고, 세션은 하나를 공유하며, 이벤트 루프도 막지 않음)
+        faces = sorted(images_info)
+        results = await asyncio.gather(*(
+            asyncio.to_thread(preprocess_face, session_dir / images_info[face]["saved_filename"])
+            for face in faces
+        ))
+        
+        for face, (square_array, rgb_values, error) in zip(faces, results):
+            if error is not None:
+                print(f"  {face} 면 처리 실패: {error}")
                 continue
+            
+            all_rgb_values.extend(rgb_values)
+            all_images_data.append({
+                'face': face,
+                'array': square_array
+            })
+            
+            print(f"  {face} 면: RGB 수집 완료 (9개 칸)")
         
         if len(all_rgb_values) < 54:
             return JSONResponse(
@@ -948,7 +1053,7 @@ async def analyze_cube_images(request: Request):
         # Phase 2-A: RGB 클러스터링
         print(f"\nPhase 2-A: RGB 클러스터링 (6개 그룹)")
         
-        kmeans_rgb = KMeans(n_clusters=6, random_state=42, n_init=10)
+        kmeans_rgb = KMeans(**KMEANS_PARAMS)
         kmeans_rgb.fit(all_rgb_array)
         
         rgb_cluster_centers = kmeans_rgb.cluster_centers_
@@ -961,7 +1066,7 @@ async def analyze_cube_images(request: Request):
         
         # RGB 클러스터를 색상에 매칭
         rgb_cluster_to_color, rgb_distances = match_clusters_to_colors(
-            rgb_cluster_centers, REFERENCE_COLORS_RGB, rgb_distance
+            rgb_cluster_centers, REFERENCE_RGB_ARRAY, rgb_distance_sq
         )
         
         print("\nRGB 매칭:")
@@ -971,15 +1076,10 @@ async def analyze_cube_images(request: Request):
         # Phase 2-B: HSV 클러스터링
         print(f"\nPhase 2-B: HSV 클러스터링 (6개 그룹)")
         
-        # RGB를 HSV로 변환
-        all_hsv_array = []
-        for rgb in all_rgb_array:
-            rgb_pixel = np.uint8([[rgb]])
-            hsv_pixel = cv2.cvtColor(rgb_pixel, cv2.COLOR_RGB2HSV)
-            all_hsv_array.append(hsv_pixel[0][0])
-        all_hsv_array = np.array(all_hsv_array)
+        # RGB를 HSV로 변환 (전체 칸 일괄 처리)
+        all_hsv_array = rgb_to_hsv_array(all_rgb_array)
         
-        kmeans_hsv = KMeans(n_clusters=6, random_state=42, n_init=10)
+        kmeans_hsv = KMeans(**KMEANS_PARAMS)
         kmeans_hsv.fit(all_hsv_array)
         
         hsv_cluster_centers = kmeans_hsv.cluster_centers_
@@ -992,7 +1092,7 @@ async def analyze_cube_images(request: Request):
         
         # HSV 클러스터를 색상에 매칭
         hsv_cluster_to_color, hsv_distances = match_clusters_to_colors(
-            hsv_cluster_centers, REFERENCE_COLORS_HSV, hsv_distance
+            hsv_cluster_centers, REFERENCE_HSV_ARRAY, hsv_distance_sq
         )
         
         print("\nHSV 매칭 (후처리 전):")
@@ -1010,54 +1110,38 @@ async def analyze_cube_images(request: Request):
         # Phase 3: 앙상블 투표
         print(f"\nPhase 3: 앙상블 투표 (RGB + HSV 종합)")
         
+        # 클러스터별 색상/거리를 코드 배열로 변환한 뒤 모든 칸을 한 번에 투표
+        rgb_codes = np.array([COLOR_CODES[rgb_cluster_to_color[i]] for i in range(len(rgb_cluster_centers))])
+        hsv_codes = np.array([COLOR_CODES[hsv_cluster_to_color[i]] for i in range(len(hsv_cluster_centers))])
+        rgb_dist_array = np.array([rgb_distances[i] for i in range(len(rgb_cluster_centers))])
+        hsv_dist_array = np.array([hsv_distances[i] for i in range(len(hsv_cluster_centers))])
+        
+        final_codes, cell_confidences, reason_codes = ensemble_vote(
+            rgb_codes[rgb_labels], hsv_codes[hsv_labels],
+            rgb_dist_array[rgb_labels], hsv_dist_array[hsv_labels],
+            all_hsv_array
+        )
+        
+        agree_count = int(np.count_nonzero(reason_codes == BOTH_AGREE))
+        recheck_count = int(np.count_nonzero(reason_codes == HSV_RECHECK))
+        rgb_win_count = int(np.count_nonzero(reason_codes == RGB_WINS))
+        hsv_win_count = int(np.count_nonzero(reason_codes == HSV_WINS))
+        
+        # 응답에 쓸 칸별 값을 한 번에 이름/파이썬 값으로 변환 (면 루프에서는 슬라이스만)
+        final_names = [COLOR_NAMES[code] for code in final_codes]
+        reason_names = [REASON_NAMES[code] for code in reason_codes]
+        cell_confidences = cell_confidences.tolist()
+        
         cube_colors = {}
         analysis_results = {}
-        cell_idx = 0
-        
-        agree_count = 0
-        rgb_win_count = 0
-        hsv_win_count = 0
-        recheck_count = 0
         
-        for img_data in all_images_data:
+        for img_idx, img_data in enumerate(all_images_data):
             face = img_data['face']
+            start = img_idx * 9
             
-            colors_full = []
-            confidences = []
-            reasons = []
-            
-            for row in range(3):
-                for col in range(3):
-                    rgb_cluster = rgb_labels[cell_idx]
-                    hsv_cluster = hsv_labels[cell_idx]
-                    
-                    rgb_color = rgb_cluster_to_color[rgb_cluster]
-                    hsv_color = hsv_cluster_to_color[hsv_cluster]
-                    
-                    rgb_dist = rgb_distances[rgb_cluster]
-                    hsv_dist = hsv_distances[hsv_cluster]
-                    
-                    # 개별 칸의 실제 HSV 값 전달 (재검증용)
-                    hsv_raw = all_hsv_array[cell_idx]
-                    
-                    final_color, confidence, reason = ensemble_vote(
-                        rgb_color, hsv_color, rgb_dist, hsv_dist, hsv_raw
-                    )
-                    
-                    colors_full.append(final_color)
-                    confidences.append(confidence)
-                    reasons.append(reason)
-                    
-                    if reason == 'both_agree':
-                        agree_count += 1
-                    elif reason == 'hsv_recheck':
-                        recheck_count += 1
-                    elif reason == 'rgb_wins':
-                        rgb_win_count += 1
-                    else:
-                        hsv_win_count += 1
-                    
-                    cell_idx += 1
+            colors_full = final_names[start:start + 9]
+            confidences = cell_confidences[start:start + 9]
+            reasons = reason_names[start:start + 9]
             
             # 색상 이름을 단일 문자로 변환
             colors = [COLOR_LABEL_MAP[c] for c in colors_full]
@@ -1066,12 +1150,8 @@ async def analyze_cube_images(request: Request):
             color_grid = [[colors[r * 3 + c] for c in range(3)] for r in range(3)]
             cube_colors[face] = color_grid
             
-            # 16진수 색상으로 변환
-            hex_grid = [[COLOR_MAP.get(cell, "#808080") for cell in row] for row in color_grid]
-            
             analysis_results[face] = {
                 "colors": color_grid,
-                "hex_colors": hex_grid,
                 "confidences": confidences,
                 "reasons": reasons,
                 "status": "success"
@@ -1082,6 +1162,14 @@ async def analyze_cube_images(request: Request):
                 conf_str = " ".join([f"{confidences[r_idx*3+c]:.0%}" for c in range(3)])
                 print(f"  {' '.join(row)}  ({conf_str})")
         
+        # 16진수 색상으로 변환 (면 루프가 끝난 뒤 모든 면을 한 번에)
+        hex_grids = {
+            face: [[COLOR_MAP.get(c, "#808080") for c in row] for row in grid]
+            for face, grid in cube_colors.items()
+        }
+        for face, hex_grid in hex_grids.items():
+            analysis_results[face]["hex_colors"] = hex_grid
+        
         # 통계 출력
         print(f"\n앙상블 통계:")
         print(f"총 칸 수: {total_cells}")
@@ -1118,24 +1206,30 @@ async def analyze_cube_images(request: Request):
             with open(result_path, 'w', encoding='utf-8') as f:
                 f.write(json.dumps(result_data, ensure_ascii=False, indent=2))
         
+        # 응답에는 핵심 필드만 포함 (?debug=1이면 신뢰도/근거/클러스터 중심까지 포함)
+        # 디스크의 analyzed_colors.json은 항상 전체 데이터를 유지
+        include_debug = request.query_params.get("debug") in ("1", "true")
+        response_data = {
+            "cube_colors": cube_colors,
+            "analysis_results": {
+                face: {key: result[key] for key in ANALYSIS_CORE_FIELDS}
+                for face, result in analysis_results.items()
+            },
+            "ensemble_stats": result_data["ensemble_stats"],
+            "result_file": str(result_path)
+        }
+        if include_debug:
+            response_data["analysis_results"] = analysis_results
+            response_data["rgb_cluster_centers"] = result_data["rgb_cluster_centers"]
+            response_data["hsv_cluster_centers"] = result_data["hsv_cluster_centers"]
+        
         return JSONResponse(
             status_code=200,
             content={
                 "success": True,
                 "message": f"{len(cube_colors)}개 면의 색상 분석이 완료되었습니다 (RGB + HSV 이중 클러스터링 앙상블)",
                 "session_id": session_id,
-                "data": {
-                    "cube_colors": cube_colors,
-                    "analysis_results": analysis_results,
-                    "ensemble_stats": {
-                        "total_cells": total_cells,
-                        "agree_count": agree_count,
-                        "recheck_count": recheck_count,
-                        "rgb_win_count": rgb_win_count,
-                        "hsv_win_count": hsv_win_count
-                    },
-                    "result_file": str(result_path)
-                }
+                "data": response_data
             }
         )
         
@@ -1188,15 +1282,18 @@ async def generate_solution(request: Request):
                     detail="큐브 색상 분석 결과를 찾을 수 없습니다. 먼저 /analyze-cube-images를 호출하세요."
                 )
             
-            # 분석 결과 읽기
-            if HAS_AIOFILES:
-                async with aiofiles.open(result_path, 'r', encoding='utf-8') as f:  # type: ignore
-                    content = await f.read()
+            # 분석 결과 읽기 (큰 파일은 mmap, 이벤트 루프를 막지 않도록 스레드에서)
+            if result_path.stat().st_size > MMAP_READ_THRESHOLD:
+                analysis_data = await asyncio.to_thread(read_json_mmap, result_path)
             else:
-                with open(result_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            
-            analysis_data = json.loads(content)
+                if HAS_AIOFILES:
+                    async with aiofiles.open(result_path, 'r', encoding='utf-8') as f:  # type: ignore
+                        content = await f.read()
+                else:
+                    with open(result_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                
+                analysis_data = json.loads(content)
             cube_colors = analysis_data["cube_colors"]
             print(f"\n[세션 {session_id[:8]}...] 세션 파일에서 큐브 색상 사용 (이미지 분석)")
         
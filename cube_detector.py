@@ -1,155 +1,180 @@
 # cube_face_reader.py
 # 스티커 9개를 검출하되, 같은 평면의 3x3 격자만 선택
-import cv2, numpy as np, json, glob
+import cv2, numpy as np, json, os
 from pathlib import Path
 from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 IN_DIR  = Path("uploaded_images")
 OUT_DIR = Path("outputs")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
+IMG_EXTS = {".jpg", ".jpeg", ".png"}
+
+# Numba가 있으면 타일 색 판정 규칙을 네이티브 코드로 컴파일 (없으면 파이썬으로 실행)
+try:
+    from numba import njit
+    jit = njit(cache=True)
+except ImportError:
+    jit = lambda func: func
 
 def order_quad(pts: np.ndarray) -> np.ndarray:
-    pts = np.array(pts, dtype=np.float32).reshape(-1,2)
-    s = pts.sum(1); d = np.diff(pts, axis=1).reshape(-1)
-    out = np.zeros((4,2), np.float32)
-    out[0] = pts[np.argmin(s)]  # TL
-    out[2] = pts[np.argmax(s)]  # BR
-    out[1] = pts[np.argmin(d)]  # TR
-    out[3] = pts[np.argmax(d)]  # BL
-    return out
+    # 점이 몇 개뿐이라 NumPy argmin/argmax 대신 파이썬 리스트로 비교
+    pts = np.asarray(pts, dtype=np.float32).reshape(-1,2).tolist()
+    s = [x+y for x, y in pts]; d = [y-x for x, y in pts]
+    return np.array([pts[s.index(min(s))],   # TL
+                     pts[d.index(min(d))],   # TR
+                     pts[s.index(max(s))],   # BR
+                     pts[d.index(max(d))]],  # BL
+                    np.float32)
 
 def draw_rot_rect(mask: np.ndarray, rr, color=255):
     box = cv2.boxPoints(rr).astype(np.int32)
     cv2.fillPoly(mask, [box], color)
 
-def iou_rect(a: Tuple[float,float,float,float], b: Tuple[float,float,float,float]) -> float:
-    ax,ay,aw,ah = a; bx,by,bw,bh = b
-    x1 = max(ax, bx); y1 = max(ay, by)
-    x2 = min(ax+aw, bx+bw); y2 = min(ay+ah, by+bh)
-    if x2 <= x1 or y2 <= y1: return 0.0
-    inter = (x2-x1)*(y2-y1)
-    union = aw*ah + bw*bh - inter
-    return inter/union
+# 스티커 마스크용 CLAHE/형태학 커널 (호출마다 새로 만들지 않도록 모듈 로드 시 한 번 생성)
+STICKER_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+STICKER_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT,(5,5))
+
+def above(t: float) -> int:
+    """uint8 채널에서 x > t와 같은 inRange 하한 (x >= above(t))"""
+    return int(np.floor(t)) + 1
 
 def sticker_mask(bgr: np.ndarray) -> np.ndarray:
     """V가 밝고 (채도 높거나, 아주 낮은데 밝은 화이트)인 픽셀만 남김 - 적응형 임계값 사용"""
     # 히스토그램 평활화로 조명 보정
+    # a/b 채널은 그대로이므로 split/merge 없이 L 채널만 바꿔 씀
     lab = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    l = clahe.apply(l)
-    lab = cv2.merge([l,a,b])
+    lab[:,:,0] = STICKER_CLAHE.apply(lab[:,:,0])
     bgr_enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
     
     hsv = cv2.cvtColor(bgr_enhanced, cv2.COLOR_BGR2HSV)
-    H,S,V = cv2.split(hsv)
     
-    # 적응형 임계값 계산
-    v_mean = np.mean(V)
-    v_std = np.std(V)
-    s_mean = np.mean(S)
+    # 적응형 임계값 계산 (채널 분리 없이 HSV 전체에서 한 번에)
+    mean, std = cv2.meanStdDev(hsv)
+    s_mean, v_mean = mean[1,0], mean[2,0]
+    v_std = std[2,0]
     
     # 밝기에 따라 임계값 동적 조정
     v_thresh = max(70, min(110, v_mean - 0.5 * v_std))
     s_thresh = max(35, min(60, s_mean - 0.3 * v_std))
     
+    # 마스크는 cv2.inRange 한 패스로 생성 (uint8이라 x > t는 x >= floor(t)+1, 경계 포함)
     # 색상 스티커: 적당한 명도와 채도
-    m_color  = (V > v_thresh) & (S > s_thresh)
+    m = cv2.inRange(hsv, (0, above(s_thresh), above(v_thresh)), (255, 255, 255))
     
     # 흰색 스티커: 높은 명도, 낮은 채도
     white_v_thresh = max(160, v_mean + 0.3 * v_std) if v_mean > 100 else 150
-    m_white  = (V > white_v_thresh) & (S < 45)
+    cv2.bitwise_or(m, cv2.inRange(hsv, (0, 0, above(white_v_thresh)), (255, 44, 255)), dst=m)
     
     # 어두운 조명 조건을 위한 추가 마스크
     if v_mean < 120:  # 어두운 이미지인 경우
-        m_dark = (V > max(60, v_mean - v_std)) & (S > max(30, s_mean - 20))
-        m = (m_color | m_white | m_dark).astype(np.uint8)*255
-    else:
-        m = (m_color | m_white).astype(np.uint8)*255
+        lower = (0, above(max(30, s_mean - 20)), above(max(60, v_mean - v_std)))
+        cv2.bitwise_or(m, cv2.inRange(hsv, lower, (255, 255, 255)), dst=m)
     
     # 형태학적 연산으로 노이즈 제거 및 구멍 채우기
-    k = cv2.getStructuringElement(cv2.MORPH_RECT,(5,5))
-    m = cv2.morphologyEx(m, cv2.MORPH_OPEN, k, 2)
-    m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, k, 3)
+    # OPEN(erode→dilate) 후 CLOSE(dilate→erode)와 동일: 가운데 dilate 두 번을 한 호출로 합쳐 3패스로 처리
+    # (기존 morphologyEx(m, op, k, 2/3)의 숫자는 dst 자리라 반복 횟수가 아니었음, 결과는 각 1회 적용과 같음)
+    m = cv2.erode(m, STICKER_KERNEL)
+    m = cv2.dilate(m, STICKER_KERNEL, iterations=2)
+    m = cv2.erode(m, STICKER_KERNEL)
     return m
 
+def grid_3x3_batch(sets: np.ndarray, tolerance: float=0.3) -> np.ndarray:
+    """(k, 9, 2) 중심점 묶음마다 3x3 격자를 형성하는지 한 번에 검증 → (k,) bool"""
+    # x/y를 함께 3개씩 세 구간으로 나눠 구간 평균 (전체 정렬 대신 partition)
+    means = np.partition(sets, [2,5], axis=1).reshape(len(sets),3,3,-1).mean(axis=2)
+    spacing = np.diff(means, axis=1)  # (k, 2, 2): [앞 간격, 뒤 간격] x [x, y]
+    lo, hi = spacing.min(axis=1), spacing.max(axis=1)
+    # 축마다 간격 비율 min/max가 (1 - tolerance) 이상이어야 함 (간격이 0이면 통과)
+    return np.all((hi <= 0) | (lo >= (1 - tolerance) * hi), axis=1)
+
 def is_grid_3x3(centers: np.ndarray, tolerance: float=0.3) -> bool:
     """9개 중심점이 3x3 격자를 형성하는지 검증"""
     if len(centers) != 9:
         return False
-    xs = sorted(centers[:,0]); ys = sorted(centers[:,1])
-    x_groups = [xs[0:3], xs[3:6], xs[6:9]]
-    y_groups = [ys[0:3], ys[3:6], ys[6:9]]
-    x_means = [np.mean(g) for g in x_groups]
-    y_means = [np.mean(g) for g in y_groups]
-    x_spacing = [x_means[1]-x_means[0], x_means[2]-x_means[1]]
-    y_spacing = [y_means[1]-y_means[0], y_means[2]-y_means[1]]
-    if max(x_spacing) > 0:
-        x_ratio = min(x_spacing) / max(x_spacing)
-        if x_ratio < (1 - tolerance): return False
-    if max(y_spacing) > 0:
-        y_ratio = min(y_spacing) / max(y_spacing)
-        if y_ratio < (1 - tolerance): return False
-    return True
+    return bool(grid_3x3_batch(centers[None], tolerance)[0])
+
+# 스티커 검출 축소 배율 (짧은 변이 STICKER_DOWNSCALE_MIN_SIZE 이상인 이미지만, 워핑/색 판정은 원본 해상도)
+STICKER_DOWNSCALE = 2
+STICKER_DOWNSCALE_MIN_SIZE = 1000
 
 def find_9_stickers(bgr: np.ndarray) -> Tuple[List[tuple], np.ndarray]:
     H,W = bgr.shape[:2]
-    mask = sticker_mask(bgr)
-    cnts,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # 큰 사진은 축소본에서 마스크/후보를 구하고 스티커 사각형만 원본 좌표로 되돌림
+    scale = STICKER_DOWNSCALE if min(H,W) >= STICKER_DOWNSCALE_MIN_SIZE else 1
+    small = cv2.resize(bgr, None, fx=1/scale, fy=1/scale, interpolation=cv2.INTER_AREA) if scale > 1 else bgr
+    mask = sticker_mask(small)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
     cands = []
     
-    # 이미지 크기에 따른 최소 면적 동적 조정
-    min_area = max(0.0008*H*W, 400)  # 더 작은 스티커도 감지
-    max_area = 0.18*H*W
+    # 이미지 크기에 따른 최소 면적 동적 조정 (픽셀 단위 하한은 축소 배율만큼 줄임)
+    h_s, w_s = mask.shape
+    min_area = max(0.0008*h_s*w_s, 400/scale**2)  # 더 작은 스티커도 감지
+    max_area = 0.18*h_s*w_s
+    min_side = 15/scale
     
-    for c in cnts:
-        area = cv2.contourArea(c)
-        if area < min_area or area > max_area:
-            continue
-        rr = cv2.minAreaRect(c)
+    # 면적/바운딩박스 조건은 컴포넌트 통계로 한 번에 필터링 (0번은 배경)
+    area = stats[1:, cv2.CC_STAT_AREA]
+    bw = stats[1:, cv2.CC_STAT_WIDTH]; bh = stats[1:, cv2.CC_STAT_HEIGHT]
+    keep = (area >= min_area) & (area <= max_area) & (np.minimum(bw, bh) >= min_side)
+    
+    # 살아남은 컴포넌트만 minAreaRect로 정밀 검사
+    for i in np.flatnonzero(keep) + 1:
+        x, y, w, h, a = stats[i]
+        pts = cv2.findNonZero((labels[y:y+h, x:x+w] == i).astype(np.uint8))
+        rr = cv2.minAreaRect(pts + np.int32([x, y]))
         (cx,cy),(w,h),ang = rr
-        if min(w,h) < 15:  # 더 작은 스티커 허용
+        if min(w,h) < min_side:  # 더 작은 스티커 허용
             continue
         aspect = min(w,h)/max(w,h) if max(w,h) > 0 else 0
         rect_area = w*h
-        fill_ratio = area/max(1.0,rect_area)
+        fill_ratio = a/max(1.0,rect_area)
         
         # 더 유연한 조건
         if aspect < 0.65:     # 정사각형 조건 완화
             continue
         if fill_ratio < 0.50:  # 채움 비율 조건 완화
             continue
-        cands.append((rr, area))
+        cands.append((rr, float(a)))
 
-    # NMS
-    boxes = []
-    for rr, area in sorted(cands, key=lambda x:-x[1]):
-        (cx,cy),(w,h),ang = rr
-        br = (cx-w/2, cy-h/2, w, h)
-        if any(iou_rect(br, b) > 0.30 for b,_ in boxes):
-            continue
-        boxes.append((br, rr))
-    rects = [rr for _,rr in boxes]
+    # NMS (면적 내림차순, IoU 0.30 초과 시 제거)
+    rects = []
+    if cands:
+        boxes = [(cx-w/2, cy-h/2, w, h) for ((cx,cy),(w,h),_),_ in cands]
+        keep = cv2.dnn.NMSBoxes(boxes, [area for _,area in cands], 0.0, 0.30)
+        rects = [cands[i][0] for i in np.asarray(keep).reshape(-1)]
+
+    if scale > 1:
+        rects = [((cx*scale, cy*scale), (w*scale, h*scale), ang) for (cx,cy),(w,h),ang in rects]
+        mask = cv2.resize(mask, (W,H), interpolation=cv2.INTER_NEAREST)
 
     if len(rects) < 9:
         return [], mask
 
     # 9개 이상이면 3x3 격자를 형성하는 조합 찾기
     centers = np.array([rr[0] for rr in rects], np.float32)
-    img_center = np.array([W/2, H/2])
+    img_center = np.array([W/2, H/2], np.float32)  # centers와 같은 float32로 유지 (float64 승격 방지)
     dists = np.sum((centers - img_center)**2, axis=1)
     sorted_idx = np.argsort(dists)
-    for i in range(min(len(rects)-8, 20)):
-        test_idx = sorted_idx[i:i+9]
-        test_centers = centers[test_idx]
-        if is_grid_3x3(test_centers, tolerance=0.35):
-            rects = [rects[j] for j in test_idx]
-            break
-    else:
-        rects = [rects[j] for j in sorted_idx[:9]]
+    # 중심에서 가까운 순으로 9개씩 미는 창(최대 20개)을 한 번에 검사해 첫 번째 격자 선택
+    n_windows = min(len(rects)-8, 20)
+    windows = sorted_idx[np.arange(n_windows)[:,None] + np.arange(9)]
+    is_grid = grid_3x3_batch(centers[windows], tolerance=0.35)
+    chosen = windows[is_grid.argmax()] if is_grid.any() else sorted_idx[:9]
+    rects = [rects[j] for j in chosen]
 
     return rects[:9], mask
 
+# 워핑 목적지 꼭짓점 (출력 크기가 고정이라 크기별로 한 번만 생성)
+_WARP_DST = {}
+
+def warp_dst(size: int) -> np.ndarray:
+    dst = _WARP_DST.get(size)
+    if dst is None:
+        dst = np.array([[0,0],[size-1,0],[size-1,size-1],[0,size-1]], np.float32)
+        _WARP_DST[size] = dst
+    return dst
+
 def warp_by_sticker_union(bgr: np.ndarray, rects: List[tuple], size:int=720):
     """9개 스티커 중심점 기반으로 안정적 워핑"""
     H,W = bgr.shape[:2]
@@ -165,19 +190,67 @@ def warp_by_sticker_union(bgr: np.ndarray, rects: List[tuple], size:int=720):
     center_point = quad.mean(axis=0)
     quad = center_point + (quad - center_point) * 1.2
     quad = order_quad(quad)
-    dst = np.array([[0,0],[size-1,0],[size-1,size-1],[0,size-1]], np.float32)
-    M = cv2.getPerspectiveTransform(quad, dst)
-    warp = cv2.warpPerspective(bgr, M, (size,size))
+    # 출력→입력 방향 행렬을 직접 구해 warpPerspective 내부의 역행렬 계산 생략
+    M_inv = cv2.getPerspectiveTransform(warp_dst(size), quad)
+    warp = cv2.warpPerspective(bgr, M_inv, (size,size), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
     mask = np.zeros((H,W), np.uint8)
     cv2.fillPoly(mask, [quad.astype(np.int32)], 255)
     return warp, mask, quad
 
+# 타일 라벨 (classify_tile이 돌려주는 인덱스 순서) 과 최근접 보정용 HSV 중심/Hue 가중치
+TILE_LABELS = ("WHITE", "YELLOW", "GREEN", "BLUE", "ORANGE", "RED")
+TILE_CENTERS = np.array([(0,   0, 235),
+                         (31,140,200),
+                         (65,140,180),
+                         (110,140,180),
+                         (20,165,195),
+                         (0, 180,180)], np.float64)
+TILE_HUE_WEIGHTS = np.array([2.0, 2.0, 2.0, 2.0, 2.2, 2.2])
+
+@jit
+def classify_tile(Hm, Sm, Vm, Cbv, S_thr, V_thr, centers, hue_weights):
+    """중앙값 H,S,V(+경계대 Cb, 없으면 -1)로 TILE_LABELS 인덱스 반환"""
+    # 1) WHITE: 저채도·고명도
+    if Sm < S_thr and Vm > V_thr:
+        return 0
+    # 2) ORANGE → RED 우선순위 (ORANGE: 8~28°, RED: 0~8° 또는 172~180°)
+    if 8 < Hm <= 28 and Sm > 60 and Vm > 85:
+        return 4
+    if (Hm <= 8 or Hm >= 172) and Sm > 60 and Vm > 70:
+        # 경계대(6~22°)에서 Cb 높으면 주황으로 뒤집기
+        if 6 < Hm <= 22 and Cbv >= 115:
+            return 4
+        return 5
+    # 3) 나머지 기본색
+    if 28 < Hm <= 42 and Sm > 55 and Vm > 85:
+        return 1
+    if 42 < Hm <= 90 and Sm > 50 and Vm > 75:
+        return 2
+    if 90 < Hm <= 140 and Sm > 45 and Vm > 70:
+        return 3
+    # 4) 최근접 중심 보정(안전장치)
+    best = 0; best_score = np.inf
+    for i in range(centers.shape[0]):
+        d = abs(Hm - centers[i, 0]); d = min(d, 180 - d)
+        score = (hue_weights[i]*d)**2 + (Sm - centers[i, 1])**2 + (Vm - centers[i, 2])**2
+        if score < best_score:
+            best = i; best_score = score
+    return best
+
+@jit
+def classify_tiles(hsv_med, Cbv, S_thr, V_thr, centers, hue_weights):
+    """9개 타일의 중앙값 (9,3)/Cb (9,)를 한 번의 호출로 판정 → TILE_LABELS 인덱스 배열"""
+    labels = np.zeros(hsv_med.shape[0], np.int64)
+    for i in range(hsv_med.shape[0]):
+        labels[i] = classify_tile(hsv_med[i, 0], hsv_med[i, 1], hsv_med[i, 2], Cbv[i],
+                                  S_thr, V_thr, centers, hue_weights)
+    return labels
+
 def tiles_labels_with_numbers(bgr: np.ndarray, margin: float=0.18):
     """HSV 규칙 + YCrCb 보정으로 6색 분류 (ORANGE 우선)"""
     H,W = bgr.shape[:2]
     n=3; ch, cw = H//n, W//n
-    hsv   = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
-    ycrcb = cv2.cvtColor(bgr, cv2.COLOR_BGR2YCrCb)  # 보정용
+    hsv   = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)  # S/V 백분위수에 전체 프레임 필요
 
     S20 = int(np.percentile(hsv[:,:,1], 20))
     V60 = int(np.percentile(hsv[:,:,2], 60))
@@ -186,72 +259,45 @@ def tiles_labels_with_numbers(bgr: np.ndarray, margin: float=0.18):
         y0,x0=r*ch,c*cw; y1,x1=(r+1)*ch,(c+1)*cw
         yy0,yy1 = int(y0+margin*ch), int(y1-margin*ch)
         xx0,xx1 = int(x0+margin*cw), int(x1-margin*cw)
-        return hsv[yy0:yy1, xx0:xx1], ycrcb[yy0:yy1, xx0:xx1]
+        return hsv[yy0:yy1, xx0:xx1], bgr[yy0:yy1, xx0:xx1]
 
     def med3(a3):
         if a3.size==0: return np.array([0,0,0],np.float32)
-        arr = a3.reshape(-1,3).astype(np.float32)
-        v = arr[:,2]; q1,q3 = np.percentile(v,[25,75])
+        # float32 변환 없이 uint8 그대로 partition (percentile/median과 같은 값)
+        arr = a3.reshape(-1,3)
+        v = arr[:,2]; n = len(v)
+        # 사분위수: np.percentile 선형 보간과 같은 값을 partition 한 번으로
+        (k1,f1), (k3,f3) = divmod((n-1)*0.25, 1), divmod((n-1)*0.75, 1)
+        k1, k3 = int(k1), int(k3); j1, j3 = min(k1+1, n-1), min(k3+1, n-1)
+        p = np.partition(v, sorted({k1, j1, k3, j3}))
+        q1 = p[k1] + f1*(float(p[j1]) - p[k1])
+        q3 = p[k3] + f3*(float(p[j3]) - p[k3])
         keep = (v>=q1)&(v<=q3)
         arr = arr[keep] if keep.any() else arr
-        return np.median(arr, axis=0)
-
-    def in_range(a,b,x): return (a < x <= b)
-    def circ_d(h1,h0):
-        d = abs(h1-h0); return min(d, 180-d)
-
-    results=[]; tile_num=1
-    for r in range(3):
-        for c in range(3):
-            hsv_p, ycc_p = patch(r,c)
-            Hm,Sm,Vm = med3(hsv_p).astype(int)
-            Ym,Crm,Cbm = med3(ycc_p).astype(int)
-
-            # 1) WHITE: 저채도·고명도
-            if (Sm < max(30, S20+5)) and (Vm > max(130, V60-10)):
-                results.append((tile_num, "WHITE")); tile_num+=1; continue
-
-            label = None
-
-            # 2) ORANGE → RED 우선순위
-            # ORANGE: 8~28°, 충분한 S,V
-            if in_range(8,28,Hm) and Sm>60 and Vm>85:
-                label = "ORANGE"
-
-            # RED: 0~8° 또는 172~180°
-            if label is None and ((Hm<=8) or (Hm>=172)) and Sm>60 and Vm>70:
-                label = "RED"
-                # 경계대(6~22°)에서 Cb 높으면 주황으로 뒤집기
-                if (6 < Hm <= 22) and (Cbm >= 115):
-                    label = "ORANGE"
-
-            # 3) 나머지 기본색
-            if label is None and in_range(28,42,Hm) and Sm>55 and Vm>85:
-                label = "YELLOW"
-            elif label is None and in_range(42,90,Hm) and Sm>50 and Vm>75:
-                label = "GREEN"
-            elif label is None and in_range(90,140,Hm) and Sm>45 and Vm>70:
-                label = "BLUE"
-
-            # 4) 최근접 중심 보정(안전장치)
-            if label is None:
-                centers = {
-                    "WHITE":  (0,   0, 235),
-                    "YELLOW": (31,140,200),
-                    "GREEN":  (65,140,180),
-                    "BLUE":   (110,140,180),
-                    "ORANGE": (20,165,195),
-                    "RED":    (0, 180,180),
-                }
-                def score(c):
-                    h0,s0,v0 = centers[c]
-                    w = 2.2 if c in ("RED","ORANGE") else 2.0
-                    return (w*circ_d(Hm,h0))**2 + (Sm-s0)**2 + (Vm-v0)**2
-                label = min(centers.keys(), key=score)
-
-            results.append((tile_num, label))
-            tile_num += 1
-    return results
+        # 중앙값: 짝수 개면 가운데 두 값의 평균 (np.median과 동일)
+        m = len(arr); mid = m//2
+        if m % 2:
+            return np.partition(arr, mid, axis=0)[mid].astype(np.float32)
+        part = np.partition(arr, [mid-1, mid], axis=0)
+        return (part[mid-1].astype(np.float32) + part[mid]) / 2
+
+    # WHITE 판정 임계값 (WHITE도 평균이 아닌 IQR 중앙값으로 판정해야 반사광에 끌려가지 않음)
+    S_thr, V_thr = max(30, S20+5), max(130, V60-10)
+
+    # 9개 타일의 중앙값을 먼저 모은 뒤 한 번에 판정
+    hsv_med = np.zeros((n*n, 3), np.int64); Cbv = np.full(n*n, -1, np.int64)
+    for i in range(n*n):
+        hsv_p, bgr_p = patch(*divmod(i, n))
+        hsv_med[i] = med3(hsv_p).astype(int)
+        # Cb 중앙값은 RED→ORANGE 경계대에서만 필요하므로 그때만 해당 패치만 YCrCb로 변환
+        if 6 < hsv_med[i, 0] <= 8:
+            Cbv[i] = int(med3(cv2.cvtColor(bgr_p, cv2.COLOR_BGR2YCrCb))[2])
+
+    labels = classify_tiles(hsv_med, Cbv, S_thr, V_thr, TILE_CENTERS, TILE_HUE_WEIGHTS)
+    return [(i+1, TILE_LABELS[label]) for i, label in enumerate(labels)]
+
+# 타일 라벨 글자 크기 (6개뿐이라 모듈 로드 시 한 번만 측정)
+LABEL_TEXT_SIZES = {label: cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0] for label in TILE_LABELS}
 
 def annotate_grid_with_numbers(bgr: np.ndarray, results: List[Tuple[int, str]]) -> np.ndarray:
     vis = bgr.copy()
@@ -266,7 +312,7 @@ def annotate_grid_with_numbers(bgr: np.ndarray, results: List[Tuple[int, str]])
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 3, cv2.LINE_AA)
             cv2.putText(vis, str(tile_num), (x0+8, y0+25),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 1, cv2.LINE_AA)
-            text_size = cv2.getTextSize(color, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0]
+            text_size = LABEL_TEXT_SIZES[color]
             text_x = x0 + (cw - text_size[0]) // 2
             text_y = y0 + (ch + text_size[1]) // 2
             cv2.putText(vis, color, (text_x, text_y),
@@ -276,50 +322,58 @@ def annotate_grid_with_numbers(bgr: np.ndarray, results: List[Tuple[int, str]])
             idx += 1
     return vis
 
-def process_one(img_path: Path):
+def process_one(img_path: Path) -> str:
+    """이미지 한 장 처리 후 결과 출력을 문자열로 반환 (프로세스 풀에서 실행, 출력 순서는 main이 유지)"""
     name = img_path.stem
     bgr = cv2.imread(str(img_path))
     if bgr is None:
-        print(f"[FAIL] load: {img_path}")
-        return
-
-    rects, raw_mask = find_9_stickers(bgr)
-    if len(rects) < 9:
-        cv2.imwrite(str(OUT_DIR/f"{name}_mask.jpg"), raw_mask)
-        print(f"[FAIL] {name}: stickers={len(rects)}, need 9")
-        return
-
-    vis = bgr.copy()
-    for rr in rects:
-        box = cv2.boxPoints(rr).astype(np.int32)
-        cv2.polylines(vis, [box], True, (0,255,0), 2)
-    cv2.imwrite(str(OUT_DIR/f"{name}_detect.jpg"), vis)
-
-    warp, union_mask, quad = warp_by_sticker_union(bgr, rects, size=720)
-    cv2.imwrite(str(OUT_DIR/f"{name}_warp.jpg"), warp)
-
-    results = tiles_labels_with_numbers(warp, margin=0.18)
-    grid = annotate_grid_with_numbers(warp, results)
-    cv2.imwrite(str(OUT_DIR/f"{name}_grid.jpg"), grid)
-
-    output_data = {
-        "file": img_path.as_posix(),
-        "tiles": [{"number": num, "color": color} for num, color in results]
-    }
-    with open(OUT_DIR/f"{name}_colors.json","w",encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-
-    print(f"\n[OK] {name}: 9 stickers detected")
-    for num, color in results:
-        print(f"  타일 {num}: {color}")
+        return f"[FAIL] load: {img_path}"
+
+    # 디버그 JPEG 인코딩/쓰기는 백그라운드 스레드로 넘겨 워핑·색 판정과 겹쳐 실행 (반환 전 모두 완료)
+    with ThreadPoolExecutor(max_workers=2) as io_pool:
+        def save(suffix, img):
+            io_pool.submit(cv2.imwrite, str(OUT_DIR/f"{name}_{suffix}.jpg"), img)
+
+        rects, raw_mask = find_9_stickers(bgr)
+        if len(rects) < 9:
+            save("mask", raw_mask)
+            return f"[FAIL] {name}: stickers={len(rects)}, need 9"
+
+        vis = bgr.copy()
+        for rr in rects:
+            box = cv2.boxPoints(rr).astype(np.int32)
+            cv2.polylines(vis, [box], True, (0,255,0), 2)
+        save("detect", vis)
+
+        warp, union_mask, quad = warp_by_sticker_union(bgr, rects, size=720)
+        save("warp", warp)
+
+        results = tiles_labels_with_numbers(warp, margin=0.18)
+        grid = annotate_grid_with_numbers(warp, results)
+        save("grid", grid)
+
+        output_data = {
+            "file": img_path.as_posix(),
+            "tiles": [{"number": num, "color": color} for num, color in results]
+        }
+        with open(OUT_DIR/f"{name}_colors.json","w",encoding="utf-8") as f:
+            json.dump(output_data, f, ensure_ascii=False, indent=2)
+
+    lines = [f"\n[OK] {name}: 9 stickers detected"]
+    lines += [f"  타일 {num}: {color}" for num, color in results]
+    return "\n".join(lines)
 
 def main():
-    files = sorted(glob.glob(str(IN_DIR/"*.jpg")))
+    # 디렉토리 한 번만 스캔, 확장자 대소문자 무시
+    files = sorted(e.path for e in os.scandir(IN_DIR)
+                   if e.is_file() and os.path.splitext(e.name)[1].lower() in IMG_EXTS) if IN_DIR.is_dir() else []
     if not files:
-        print(f"[WARN] {IN_DIR}/*.jpg 없음")
+        print(f"[WARN] {IN_DIR}/ 에 이미지(jpg/jpeg/png) 없음")
         return
-    for fp in files:
-        process_one(Path(fp))
+    # 이미지끼리 독립이므로 코어 수만큼 프로세스로 나눠 처리 (결과는 파일 순서대로 출력)
+    with ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as ex:
+        for report in ex.map(process_one, map(Path, files)):
+            print(report)
     print("\n[DONE] all saved in outputs/")
 
 if __name__ == "__main__":
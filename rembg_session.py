@@ -0,0 +1,28 @@
+from rembg import new_session
+
+# ============= ONNX Runtime 실행 provider =============
+# GPU/NPU가 있으면 우선 사용하고, 없으면 CPU로 동작
+PREFERRED_PROVIDERS = ['CUDAExecutionProvider', 'CoreMLExecutionProvider', 'CPUExecutionProvider']
+
+# 모델 이름별 rembg 세션 캐시 (프로세스당 모델 로드 1회)
+_sessions = {}
+
+def available_providers(preferred=PREFERRED_PROVIDERS):
+    """설치된 onnxruntime에서 사용 가능한 provider만 우선순위대로 반환"""
+    import onnxruntime as ort
+    available = ort.get_available_providers()
+    return [p for p in preferred if p in available] or ['CPUExecutionProvider']
+
+def get_session(model='u2net', providers=None):
+    """
+    rembg 세션 반환 (처음 호출 시 생성 후 캐시해 같은 프로세스에서 재사용)
+
+    Args:
+        model: rembg 모델 이름 ('u2net', 'u2netp' 등)
+        providers: 세션을 처음 만들 때 사용할 provider 목록 (기본: 사용 가능한 GPU 우선)
+    """
+    session = _sessions.get(model)
+    if session is None:
+        session = new_session(model, providers=providers or available_providers())
+        _sessions[model] = session
+    return session